@@ -263,3 +263,6 @@ error_tables = {
 ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
 PUNCTUATIONS = "!#$%&'()*+, -./:;<=>?@[\]^_`{|}~"
 NUMBERS = '0123456789'
+
+MAX_EDIT_DISTANCE = 2
+SPELL_CHECK_CHUNK_SIZE = 256
@@ -2,10 +2,22 @@ import re
 import sys
 import random
 import math
+import bisect
+import itertools
+import functools
 import collections
+import collections.abc
+import concurrent.futures
+import marisa_trie
 import nltk
 
-nltk.download('wordnet')
+try:
+    # numpy is only used to hand the ngram counts to the numba compiled code
+    import numpy as np
+    from numba import njit
+except ImportError:  # numba is optional, evaluate_text falls back to the pure Python loop without it
+    njit = None
+
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
@@ -27,6 +39,8 @@ class Spell_Checker:
         """
         self.lm = lm
         self.error_tables = None
+        self._noisy_channel_cache = {}  # {(candidate, token): log probability}
+        self._noisy_channel_version = None  # the version of the language model the cached values were computed from
 
     def add_language_model(self, lm):
         """Adds the specified language model as an instance variable.
@@ -36,6 +50,7 @@ class Spell_Checker:
                 lm: a Spell_Checker.Language_Model object
         """
         self.lm = lm
+        self._noisy_channel_cache = {}
 
     def add_error_tables(self, error_tables):
         """ Adds the specified dictionary of error tables as an instance variable.
@@ -47,6 +62,7 @@ class Spell_Checker:
             https://www.dropbox.com/s/ic40soda29emt4a/spelling_confusion_matrices.py?dl=0
         """
         self.error_tables = error_tables
+        self._noisy_channel_cache = {}
 
     def evaluate_text(self, text):
         """Returns the log-likelihood of the specified text given the language
@@ -68,116 +84,100 @@ class Spell_Checker:
         """
         Determine the type of error that transforms the token into the candidate.
         """
-        if len(token) < len(candidate):
-            return "deletion"
-        elif len(token) > len(candidate):
-            return "insertion"
-        else:
-            if sorted(token) == sorted(candidate):
-                return "transposition"
-            else:
-                return "substitution"
-
-    @staticmethod
-    def _insertion_chars(token, candidate):
-        """
-        Get a string of 2 characters, represents the insertion error
-        """
-        for i, c in enumerate(candidate):
-            if c != token[i]:
-                return token[i - 1] + token[i]
-        return token[i] + token[i + 1]
-
-    @staticmethod
-    def _deletion_chars(token, candidate):
-        """
-        Get a string of 2 characters, represents the deletion error
-        """
-        for i, t in enumerate(token):
-            if t != candidate[i]:
-                return token[i - 1] + candidate[i]
-        return candidate[i] + candidate[i + 1]
-
-    @staticmethod
-    def _transposition_chars(token, candidate):
-        """
-        Get a string of 2 characters, represents the transposition error
-        """
-        for i, t in enumerate(token):
-            if candidate[i] != t:
-                return token[i + 1] + t
+        return Spell_Checker._error_signature(token, candidate)[0]
 
     @staticmethod
-    def _substitution_chars(token, candidate):
+    def _check_characters_change(candidate, token):
         """
-        Get a string of 2 characters, represents the substitution error
+        Determine the type of error between the candidate and the original token.
+        Returns the misspelling two characters representing the error.
         """
-        for c, t in zip(candidate, token):
-            if c != t:
-                return t + c
+        return Spell_Checker._error_signature(token, candidate)
 
     @staticmethod
-    def _check_characters_change(candidate, token):
+    @functools.lru_cache(maxsize=2 ** 16)
+    def _error_signature(token, candidate):
         """
-        Determine the type of error between the candidate and the original token.
-        Returns the misspelling two characters representing the error.
+        Determine in a single pass over the two strings the type of error that transforms the token into the
+        candidate, and the two characters representing it.
         """
-        char_map = {
-            'insertion': Spell_Checker._insertion_chars,
-            'deletion': Spell_Checker._deletion_chars,
-            'transposition': Spell_Checker._transposition_chars,
-            'substitution': Spell_Checker._substitution_chars
-        }
-        error_type = Spell_Checker._check_error_type(token, candidate)
-        return error_type, char_map[error_type](token, candidate)
+        # i is the index of the first mismatch, or the length of the shorter string if it is a prefix of the other
+        i = 0
+        for t, c in zip(token, candidate):
+            if t != c:
+                break
+            i += 1
+        if len(token) > len(candidate):
+            return "insertion", token[i - 1] + token[i]
+        elif len(token) < len(candidate):
+            return "deletion", token[i - 1] + candidate[i]
+        elif i == len(token):
+            return "substitution", None
+        elif token[i + 1:i + 2] == candidate[i] and candidate[i + 1:i + 2] == token[i] \
+                and token[i + 2:] == candidate[i + 2:]:
+            return "transposition", token[i + 1] + token[i]
+        else:
+            return "substitution", token[i] + candidate[i]
 
     def count_chars_in_lm(self, two_chars):
         """
-        Calculates the number of times an input of two characters occurs in the text.
-        Also returns the number of distinct words in which the input occurs.
+        Calculates the number of times an input of two characters occurs in the text,
+        i.e. the total frequency of the words in which the input occurs.
         """
         if not self.lm:
             raise ValueError("Language model not set for this Spell_Checker instance")
-        else:
-            count = 0
-            for word, freq in self.lm.token_frequency.items():
-                if two_chars in word:
-                    count += freq
-            return count
+        if self.lm.bigram_char_freq is None:
+            # the model was not built by build_model (e.g. model_dict and token_frequency were set by hand)
+            self.lm.freeze()
+        return self.lm.bigram_char_freq.get(two_chars, 0)
 
     def calculate_log_noisy_channel(self, candidate, token):
-        """Calculate the log probability of a candidate given the error table."""
+        """Calculate the log probability of a candidate given the error table.
+        The result is cached until the language model is rebuilt or replaced, or the error tables are replaced."""
+        if self._noisy_channel_version != self.lm.version:
+            self._noisy_channel_cache = {}
+            self._noisy_channel_version = self.lm.version
+        log_prob = self._noisy_channel_cache.get((candidate, token))
+        if log_prob is not None:
+            return log_prob
         error_type, error_change = self._check_characters_change(candidate, token)
         count_error_change = self.count_chars_in_lm(error_change)
         count_error_in_table = self.error_tables[error_type].get(error_change, 0)
         P_x_given_t = count_error_in_table / count_error_change if count_error_change else 0
-        P_t = self.lm.token_frequency[candidate] / self.lm.total_token_count
+        P_t = self.lm.get_word_count(candidate) / self.lm.total_token_count
         P_t = P_t if P_t > 0 else 0.0001
         P_x_given_t = P_x_given_t if P_x_given_t > 0 else 0.0001
-        return math.log(P_x_given_t) + math.log(P_t)
+        log_prob = math.log(P_x_given_t) + math.log(P_t)
+        self._noisy_channel_cache[(candidate, token)] = log_prob
+        return log_prob
 
     def _generate_candidates(self, word):
         """Generate candidate words with edit distance up to 2."""
-        return self.known([word]) | self.known(self.edits1(word)) | {word}
-
-    @staticmethod
-    def edits1(token):
-        """Generate candidate words with a single edit operation."""
-        letters = 'abcdefghijklmnopqrstuvwxyz'
-        splits = [(token[:i], token[i:]) for i in range(len(token) + 1)]
-        deletes = [L + R[1:] for L, R in splits if R]
-        transposes = [L + R[1] + R[0] + R[2:] for L, R in splits if len(R) > 1]
-        replaces = [L + c + R[1:] for L, R in splits if R for c in letters]
-        inserts = [L + c + R for L, R in splits for c in letters]
-        return set(deletes + transposes + replaces + inserts)
+        return set().union(*self._candidates_by_distance(word).values()) | {word}
 
     def known(self, words):
         """ The subset of `words` that appear in the dictionary of WORDS. """
-        return set(w for w in words if w in self.lm.token_frequency)
+        return set(w for w in words if self.lm.get_word_count(w))
 
-    def edits2(self, word):
-        """ All edits that are two edits away from `word`. """
-        return (e2 for e1 in self.edits1(word) for e2 in self.edits1(e1))
+    def _candidates_by_distance(self, token, max_dist=MAX_EDIT_DISTANCE):
+        """
+        Looks up the vocabulary words up to max_dist edits away from the token, using the delete index of the
+        language model (SymSpell). Returns a dictionary mapping each edit distance to its set of candidates.
+        """
+        candidates = {distance: set() for distance in range(1, max_dist + 1)}
+        variants = _deletes(token, max_dist) | {token}
+        matches = set()
+        for variant in variants:
+            for words in self.lm.delete_trie.get(variant, ()):
+                matches.update(words.decode().split('\x00'))
+        for word in matches:
+            if abs(len(word) - len(token)) > max_dist:
+                # the index holds up to MAX_EDIT_DISTANCE deletes of every word, this one is too far anyway
+                continue
+            distance = _edit_distance(token, word)
+            if 0 < distance <= max_dist:
+                candidates[distance].add(word)
+        return candidates
 
     @staticmethod
     def _is_punctuation_or_number(token):
@@ -214,12 +214,40 @@ class Spell_Checker:
         candidates_scores = {}
         for candidate in candidates:
             if candidate == token:
-                candidates_scores[candidate] = max(alpha, self.lm.token_frequency[candidate] / self.lm.total_token_count)
+                candidates_scores[candidate] = max(alpha, self.lm.get_word_count(candidate) / self.lm.total_token_count)
             else:
-                candidates_scores[candidate] = self.lm.token_frequency[candidate] / self.lm.total_token_count
+                candidates_scores[candidate] = self.lm.get_word_count(candidate) / self.lm.total_token_count
         return candidates_scores
 
-    def spell_check(self, text, alpha, normalize=False):
+    def select_candidate_with_lm(self, candidates, token, alpha):
+        """
+           Returns the candidate word with the highest score in generate_scores_with_lm.
+            Returns None if there are no candidates.
+        """
+        scores = self.generate_scores_with_lm(candidates, token, alpha)
+        return max(scores, key=scores.get) if scores else None
+
+    def _correct_token(self, token, alpha):
+        """
+        Returns the most probable fix for a single token.
+        """
+        if self._is_punctuation_or_number(token) or self.known([token]):
+            return token
+        # Single edit candidates are preferred, the words two edits away are only used when there are none
+        candidates = self._candidates_by_distance(token)
+        correction = self.select_candidate_with_lm(candidates[1], token, alpha)
+        if correction is not None:
+            return correction
+        known_candidates = candidates[2]
+        correction = self.select_candidate_with_lm(known_candidates, token, alpha)
+        if correction is not None:
+            return correction
+        candidates_scores = self._generate_scores_with_noisy_channel(token, alpha, known_candidates)
+        if not candidates_scores:
+            return token
+        return max(candidates_scores, key=candidates_scores.get)
+
+    def spell_check(self, text, alpha, normalize=False, workers=1):
         """ Returns the most probable fix for the specified text. Use a simple
             noisy channel model if the number of tokens in the specified text is
             smaller than the length (n) of the language model.
@@ -227,35 +255,33 @@ class Spell_Checker:
             Args:
                 text (str): the text to spell check.
                 alpha (float): the probability of keeping a lexical word as is.
+                normalize (bool): True iff the text should be normalized first. Defaults to False.
+                workers (int): the number of processes correcting the tokens, chunks of
+                    SPELL_CHECK_CHUNK_SIZE tokens are corrected in parallel when above 1. Defaults to 1.
+                    Every call starts a new process pool and pickles the spell checker, language model
+                    included, into each process. This only pays off for long texts (tens of thousands of
+                    tokens) or texts with many misspelled words; a few thousand tokens are checked faster
+                    in the calling process.
 
             Return:
                 A modified string (or a copy of the original if no corrections are made.)
         """
         if normalize:
             text = normalize_text(text)
+        if self.lm.vocab_trie is None:
+            # the model was not built by build_model (e.g. model_dict and token_frequency were set by hand)
+            self.lm.freeze()
         # Tokenize the input text
         tokens = word_tokenize(text)
-        corrected_tokens = []
-        for token in tokens:
-            if self._is_punctuation_or_number(token) or self.known([token]):
-                corrected_tokens.append(token)
-                continue
-            candidates = self.edits1(token)
-            known_candidates = self.known(candidates)
-            candidates_scores = self.generate_scores_with_lm(known_candidates, token, alpha)
-            if candidates_scores:
-                corrected_tokens.append(max(candidates_scores, key=candidates_scores.get))
-                continue
-            known_candidates = self.known(self.edits2(token))
-            candidates_scores = self.generate_scores_with_lm(known_candidates, token, alpha)
-            if candidates_scores:
-                corrected_tokens.append(max(candidates_scores, key=candidates_scores.get))
-            else:
-                candidates_scores = self._generate_scores_with_noisy_channel(token, alpha, known_candidates)
-                if not candidates_scores:
-                    corrected_tokens.append(token)
-                else:
-                    corrected_tokens.append(max(candidates_scores, key=candidates_scores.get))
+        if workers > 1 and len(tokens) > SPELL_CHECK_CHUNK_SIZE:
+            # Every token is corrected independently, the spell checker is sent once to each process
+            chunks = [tokens[i:i + SPELL_CHECK_CHUNK_SIZE] for i in range(0, len(tokens), SPELL_CHECK_CHUNK_SIZE)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_spell_check_worker,
+                                                        initargs=(self,)) as executor:
+                corrected_chunks = executor.map(_correct_tokens, chunks, itertools.repeat(alpha))
+                corrected_tokens = [token for chunk in corrected_chunks for token in chunk]
+        else:
+            corrected_tokens = [self._correct_token(token, alpha) for token in tokens]
 
         return " ".join(corrected_tokens)
 
@@ -279,15 +305,30 @@ class Spell_Checker:
             """
             self.n = n
             self.chars = chars
-            self.model_dict = collections.defaultdict(
-                int)  # a dictionary of the form {ngram:count}, holding counts of all ngrams
-            self.token_frequency = collections.defaultdict(int)
-            self.total_token_count = 0
+            # a dictionary of the form {ngram:count}, holding counts of all ngrams
             # in the specified text.
             # NOTE: This dictionary format is inefficient and insufficient (why?), therefore  you can (even
             # encouraged to) use a better data structure. However, you are requested to support this format for two
             # reasons: (1) It is very straight forward and force you to understand the logic behind LM, and (2) It
             # serves as the normal form for the LM so we can call get_model_dictionary() and peek into you model.
+            # The counts are stored by the tuples of the word ids of the ngrams, the model_dict property is a live
+            # view translating them to and from the normal form.
+            self._ngram_counts = collections.Counter()
+            self._model_dict = _NgramCounts(self)
+            self.word_id = {}  # {word: int id}, ids are given in order of first appearance
+            self.id_word = []  # the word of each id
+            self.token_frequency = collections.Counter()
+            self.total_token_count = 0
+            self.bigram_char_freq = None  # {two consecutive chars: frequency of the words containing them}, by freeze()
+            self.vocab_trie = None  # read-only {word: [(count,)]} trie, built by freeze()
+            self.delete_trie = None  # read-only {delete variant: [b'word\x00word...']} trie (SymSpell)
+            self.version = 0  # incremented by every freeze(), so the caches of a spell checker can tell a rebuild
+            self._ngram_hash_keys = None  # open addressing table of the ngram ids, one row per slot
+            self._ngram_hash_counts = None  # the ngram count of each slot of the table
+            self._total_ngram_count = None  # sum of the ngram counts, cached for smooth()
+            self._vocab_card = None  # number of distinct ngrams, cached for smooth()
+            self._smoothing_source = None  # the ngram counts the two cached values were computed from
+            self.successors = None  # {context ids: (next word ids, cumulative counts)}, built by generate()
 
         def build_model(self, text):  # should be called build_model
             """populates the instance variable model_dict.
@@ -304,8 +345,7 @@ class Spell_Checker:
             words = list(text) if self.chars else text.split()
 
             # construct the token frequencies dictionary
-            for word in words:
-                self.token_frequency[word] += 1
+            self.token_frequency.update(words)
 
             # calculate total_token_count
             self.total_token_count = sum(self.token_frequency.values())
@@ -316,10 +356,85 @@ class Spell_Checker:
             # that every n-gram has a full context of 3 words.
             words = ['<s>'] * (self.n - 1) + words + ['</s>']
 
-            # construct ngrams and count occurrences
-            for i in range(len(words) - self.n + 1):
-                ngram = tuple(words[i:i + self.n])
-                self.model_dict[ngram] += 1
+            # give an id to every new word, the ngrams are counted by the ids of their words
+            ids = self._word_ids(words)
+
+            # construct ngrams and count occurrences, zip builds each ngram straight from n shifted views of the
+            # ids (no slice per ngram)
+            self._ngram_counts.update(zip(*(ids[i:] for i in range(self.n))))
+
+            self.freeze()
+
+        def freeze(self):
+            """Builds the compact read-only structures used for lookups while spell checking.
+                Called at the end of build_model, the dictionaries of the model are kept as they are.
+            """
+            # the ngram counts are updated in place by build_model
+            self._smoothing_source = None
+            self.version += 1
+
+            self.vocab_trie = marisa_trie.RecordTrie(
+                '<I', ((word, (count,)) for word, count in self.token_frequency.items()))
+
+            # construct the two characters frequencies, used as the noisy channel denominators
+            self.bigram_char_freq = collections.defaultdict(int)
+            for word, freq in self.token_frequency.items():
+                for two_chars in {word[i:i + 2] for i in range(len(word) - 1)}:
+                    self.bigram_char_freq[two_chars] += freq
+
+            # Index every vocabulary word under all the strings obtained by deleting up to MAX_EDIT_DISTANCE
+            # characters from it (SymSpell). At spell checking time only the deletes of the misspelled token are
+            # looked up, instead of generating all its inserts, replaces and transposes.
+            delete_index = collections.defaultdict(list)
+            for word in self.token_frequency:
+                for variant in _deletes(word, MAX_EDIT_DISTANCE) | {word}:
+                    delete_index[variant].append(word)
+            self.delete_trie = marisa_trie.BytesTrie(
+                (variant, '\x00'.join(words).encode()) for variant, words in delete_index.items())
+
+            # rebuilt from the new counts by the next generate()
+            self.successors = None
+
+            if njit is not None:
+                # Flatten the ngram counts into int arrays so evaluate_text can run as compiled code
+                ngram_ids = np.array(list(self._ngram_counts), dtype=np.int32).reshape(-1, self.n)
+                ngram_counts = np.fromiter(self._ngram_counts.values(), dtype=np.int64,
+                                           count=len(self._ngram_counts))
+                # next power of 2 keeping the load factor of the table under 0.5
+                table_size = 1 << max(1, (2 * len(self._ngram_counts) - 1).bit_length())
+                self._ngram_hash_keys, self._ngram_hash_counts = _build_ngram_table(ngram_ids, ngram_counts,
+                                                                                    table_size)
+
+        @property
+        def model_dict(self):
+            """The model in its normal form {ngram: count}, a live view over the ngram counts of the model."""
+            return self._model_dict
+
+        @model_dict.setter
+        def model_dict(self, model_dict):
+            self._ngram_counts = collections.Counter()
+            for ngram, count in model_dict.items():
+                self._ngram_counts[tuple(self._word_ids(ngram))] += count
+            self._ngram_counts_changed()
+
+        def _ngram_counts_changed(self):
+            """Drops the structures built from the previous ngram counts."""
+            self._ngram_hash_keys = self._ngram_hash_counts = self.successors = None
+            self._smoothing_source = None
+
+        def _word_ids(self, words):
+            """Returns the list of the ids of the specified words, new words get the next free ids."""
+            for word in dict.fromkeys(words):
+                if word not in self.word_id:
+                    self.word_id[word] = len(self.id_word)
+                    self.id_word.append(word)
+            return list(map(self.word_id.__getitem__, words))
+
+        def _ngram_key(self, words):
+            """Returns the tuple of the ids of the specified words (an ngram or a context). Unknown words get the
+                id -1 that no word of the model has.
+            """
+            return tuple(self.word_id.get(word, -1) for word in words)
 
         def get_token_frequency(self):
             """Returns the dictionary class object
@@ -331,6 +446,15 @@ class Spell_Checker:
             """
             return self.total_token_count
 
+        def get_word_count(self, word):
+            """Returns the count of the word in the model, 0 for out of vocabulary words.
+            """
+            if self.vocab_trie is None:
+                # the model was not built by build_model (e.g. model_dict and token_frequency were set by hand)
+                self.freeze()
+            counts = self.vocab_trie.get(word)
+            return counts[0][0] if counts else 0
+
         def get_model_dictionary(self):
             """Returns the dictionary class object
             """
@@ -341,6 +465,19 @@ class Spell_Checker:
             """
             return self.n
 
+        def _build_successors(self):
+            """Builds the possible next words of every context, so generate samples without scanning the ngrams.
+                Only generate uses them, so they are built by its first call rather than by freeze.
+            """
+            # The context of an ngram is its key without the last word id.
+            successors = collections.defaultdict(lambda: ([], []))
+            for key, count in self._ngram_counts.items():
+                next_ids, counts = successors[key[:-1]]
+                next_ids.append(key[-1])
+                counts.append(count)
+            self.successors = {context: (tuple(next_ids), list(itertools.accumulate(counts)))
+                               for context, (next_ids, counts) in successors.items()}
+
         def generate(self, context=None, n=20):
             """Returns a string of the specified length, generated by applying the language model
             to the specified seed context. If no context is specified the context should be sampled
@@ -358,8 +495,8 @@ class Spell_Checker:
             """
             if context is None:
                 # sample a context from the model distribution
-                contexts = [ngram[:-1] for ngram in self.model_dict.keys()]
-                context = random.choice(contexts)
+                key = random.choice(list(self._ngram_counts))
+                context = [self.id_word[word_id] for word_id in key[:-1]]
             else:
                 context = context.split() if not self.chars else list(context)
 
@@ -367,27 +504,25 @@ class Spell_Checker:
             context = ['<s>'] * (self.n - len(context)) + list(context)
             context = tuple(context[-(self.n - 1):])  # convert context to a tuple
 
+            if self.successors is None:
+                self._build_successors()
+
             # generate the output sequence
             output = list(context)
+            context_key = self._ngram_key(context)
             while len(output) < n:
-                # get the counts of all possible next words given the current context
-                counts = collections.defaultdict(int)
-                for ngram, count in self.model_dict.items():
-                    if ngram[:-1] == context:
-                        counts[ngram[-1]] += count
-
-                if counts:
-                    # Calculate the probabilities of the possible next words
-                    probabilities = {word: count / self.total_token_count for word, count in counts.items()}
-
-                    # Sample a word based on their probabilities
-                    words, probs = zip(*probabilities.items())
-                    next_word = random.choices(words, weights=probs, k=1)[0]
+                # get the possible next words given the current context
+                next_ids, cumulative_counts = self.successors.get(context_key, (None, None))
+
+                if next_ids:
+                    # Sample a word proportionally to the count of its ngram
+                    r = random.random() * cumulative_counts[-1]
+                    next_id = next_ids[bisect.bisect_right(cumulative_counts, r)]
                 else:
                     break
 
-                output.append(next_word)
-                context = context[1:] + (next_word,)
+                output.append(self.id_word[next_id])
+                context_key = (context_key + (next_id,))[1:]
 
             # Check if the last token in the output is '</s>' and remove it if necessary
             if output[-1] == '</s>':
@@ -439,24 +574,33 @@ class Spell_Checker:
             # Pad the beginning and end of the text with special start and end tokens
             words = ['<s>'] * (self.n - 1) + words + ['</s>']
 
+            # The log of the denominator is the same for every ngram, log(count / d) = log(count) - log(d)
+            if smooth:
+                log_denominator = math.log(self._get_smoothing_denominator())
+            else:
+                log_denominator = math.log(self.total_token_count)
+
+            if self._ngram_hash_keys is not None:
+                # Compiled path, unknown words get the id -1 which matches no ngram of the model
+                token_ids = np.array([self.word_id.get(word, -1) for word in words], dtype=np.int32)
+                return float(_evaluate_ngram_ids(token_ids, self._ngram_hash_keys, self._ngram_hash_counts, self.n,
+                                                 smooth, log_denominator))
+
+            # Convert the words to ids once, unknown words get an id that no word of the model has
+            ids = self._ngram_key(words)
+
             # Iterate over each ngram in the text
-            for i in range(self.n - 1, len(words)):
-                ngram = tuple(words[i - self.n + 1:i + 1])
+            for key in zip(*(ids[i:] for i in range(self.n))):
+                count = self._ngram_counts.get(key, 0)
 
                 # Check if the vocabulary size is small enough to require smoothing
                 if smooth:
-                    # Use Laplace smoothing to calculate the probability of the ngram
-                    prob = self.smooth(ngram)
-                else:
-                    # Calculate the probability of the ngram without smoothing
-                    prob = self.model_dict.get(ngram, 0) / self.total_token_count
-
-                # Take the logarithm of the probability and add it to the log probability
-                try:
-                    log_prob += math.log(prob)
-                except ValueError:
-                    # Handle the case where the probability is 0 and the logarithm is undefined
-                    log_prob += 0
+                    # Use Laplace smoothing to calculate the log probability of the ngram (see smooth)
+                    log_prob += math.log(count + 1) - log_denominator
+                elif count:
+                    # Calculate the log probability of the ngram without smoothing
+                    log_prob += math.log(count) - log_denominator
+                # Otherwise the probability is 0 and the logarithm is undefined, nothing is added
 
             # Return the log probability
             return log_prob
@@ -471,19 +615,218 @@ class Spell_Checker:
                     float. The smoothed probability.
             """
             # Get the count of the ngram in the model
-            count = self.model_dict.get(ngram, 0)
+            count = self._ngram_counts.get(self._ngram_key(ngram), 0)
 
             # Calculate the smoothed probability using Laplace smoothing
             # Add 1 to the count of the ngram and add the size of the vocabulary
-            prob = (count + 1) / (sum(self.model_dict.values()) + len(self.model_dict))
+            prob = (count + 1) / self._get_smoothing_denominator()
 
             return prob
 
+        def _get_smoothing_denominator(self):
+            """Returns the denominator of the Laplace smoothing: the sum of the ngram counts plus the number of
+                distinct ngrams. Both are cached until model_dict is replaced or the model is frozen again.
+            """
+            if self._smoothing_source is not self._ngram_counts:
+                self._total_ngram_count = sum(self._ngram_counts.values())
+                self._vocab_card = len(self._ngram_counts)
+                self._smoothing_source = self._ngram_counts
+            return self._total_ngram_count + self._vocab_card
+
+
+def _deletes(word, max_dist=2):
+    """Returns the set of all the strings obtained by deleting 1 up to max_dist characters from the word.
+        The empty string is one of them for words of up to max_dist characters, so that one and two letter words
+        share a delete with any token they are max_dist substitutions away from.
+
+        Args:
+            word (str): the word to delete characters from.
+            max_dist (int): the maximal number of deleted characters. Defaults to 2.
+
+        Returns:
+            set. The delete variants of the word.
+    """
+    deletes = set()
+    variants = {word}
+    for _ in range(max_dist):
+        variants = {variant[:i] + variant[i + 1:] for variant in variants
+                    for i in range(len(variant))}
+        deletes |= variants
+    return deletes
+
+
+def _edit_distance(source, target):
+    """Returns the edit distance between two strings, counting insertions, deletions, substitutions and
+        transpositions of adjacent characters (optimal string alignment distance).
+    """
+    before_previous_row = None
+    previous_row = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        row = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and source[i - 2] == target[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        before_previous_row, previous_row = previous_row, row
+    return previous_row[-1]
+
+
+_worker_spell_checker = None  # the spell checker of a spell_check worker process
+
+
+def _init_spell_check_worker(spell_checker):
+    """Keeps the spell checker in the worker process, called once when the process starts."""
+    global _worker_spell_checker
+    _worker_spell_checker = spell_checker
+
+
+def _correct_tokens(tokens, alpha):
+    """Returns the most probable fixes for a chunk of tokens, in a worker process of spell_check."""
+    return [_worker_spell_checker._correct_token(token, alpha) for token in tokens]
+
+
+class _NgramCounts(collections.abc.MutableMapping):
+    """The {ngram: count} normal form of a language model, as a live view over its ngram counts keyed by word
+        ids. As with the defaultdict(int) it stands for, unseen ngrams count 0, and written counts update the model.
+    """
+
+    def __init__(self, lm):
+        self._lm = lm
+
+    def __getitem__(self, ngram):
+        return self._lm._ngram_counts.get(self._lm._ngram_key(ngram), 0)
+
+    def __setitem__(self, ngram, count):
+        self._lm._ngram_counts[tuple(self._lm._word_ids(ngram))] = count
+        self._lm._ngram_counts_changed()
+
+    def __delitem__(self, ngram):
+        key = self._lm._ngram_key(ngram)
+        if key not in self._lm._ngram_counts:
+            # Counter ignores missing keys, a dict does not
+            raise KeyError(ngram)
+        del self._lm._ngram_counts[key]
+        self._lm._ngram_counts_changed()
+
+    def __contains__(self, ngram):
+        return self._lm._ngram_key(ngram) in self._lm._ngram_counts
+
+    def __iter__(self):
+        id_word = self._lm.id_word
+        return (tuple(id_word[word_id] for word_id in key) for key in self._lm._ngram_counts)
+
+    def __len__(self):
+        return len(self._lm._ngram_counts)
+
+    # __getitem__ never raises KeyError, so the helpers of MutableMapping relying on it are redefined
+    def get(self, ngram, default=None):
+        return self[ngram] if ngram in self else default
+
+    def pop(self, ngram, *default):
+        if ngram not in self:
+            if default:
+                return default[0]
+            raise KeyError(ngram)
+        count = self[ngram]
+        del self[ngram]
+        return count
+
+    def setdefault(self, ngram, default=None):
+        if ngram not in self:
+            self[ngram] = default
+        return self[ngram]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _ngram_slot(ids, start, n, hash_keys):
+    """Returns the slot of the ngram ids[start:start + n] in the open addressing table hash_keys (linear probing).
+        That is either the slot holding the ngram or the empty slot it would be inserted in.
+    """
+    mask = hash_keys.shape[0] - 1
+    slot = 0
+    for k in range(n):
+        slot = (slot * 1000003 + ids[start + k] + 1) & mask
+    while hash_keys[slot, 0] != -1:
+        match = True
+        for k in range(n):
+            if hash_keys[slot, k] != ids[start + k]:
+                match = False
+                break
+        if match:
+            break
+        slot = (slot + 1) & mask
+    return slot
+
+
+def _build_ngram_table(ngram_ids, ngram_counts, table_size):
+    """Builds the open addressing table of the ngrams, table_size must be a power of 2.
+
+        Args:
+            ngram_ids (np.ndarray): int32 array of shape (number of ngrams, n), the word ids of each ngram.
+            ngram_counts (np.ndarray): int64 array, the count of each ngram.
+            table_size (int): the number of slots in the table.
+
+        Returns:
+            tuple. The keys (-1 marks an empty slot) and the counts arrays of the table.
+    """
+    n = ngram_ids.shape[1]
+    hash_keys = np.full((table_size, n), -1, dtype=np.int32)
+    hash_counts = np.zeros(table_size, dtype=np.int64)
+    for i in range(ngram_ids.shape[0]):
+        slot = _ngram_slot(ngram_ids[i], 0, n, hash_keys)
+        for k in range(n):
+            hash_keys[slot, k] = ngram_ids[i, k]
+        hash_counts[slot] = ngram_counts[i]
+    return hash_keys, hash_counts
+
+
+def _evaluate_ngram_ids(token_ids, hash_keys, hash_counts, n, smooth, log_denominator):
+    """Returns the log-likelihood of the padded sequence of word ids, see Language_Model.evaluate_text.
+        log_denominator is the log of the smoothing denominator if smooth, else of the total token count.
+    """
+    log_prob = 0.0
+    for i in range(n - 1, token_ids.shape[0]):
+        count = hash_counts[_ngram_slot(token_ids, i - n + 1, n, hash_keys)]
+        if smooth:
+            log_prob += math.log(count + 1) - log_denominator
+        elif count > 0:
+            log_prob += math.log(count) - log_denominator
+    return log_prob
+
+
+if njit is not None:
+    _ngram_slot = njit(cache=True)(_ngram_slot)
+    _build_ngram_table = njit(cache=True)(_build_ngram_table)
+    _evaluate_ngram_ids = njit(cache=True)(_evaluate_ngram_ids)
+
+
+_NON_ALPHABETIC = re.compile(r'[^a-z]+')
+
+
+@functools.lru_cache(maxsize=None)
+def _stop_words():
+    """Returns the set of English stop words, loaded once. The NLTK stopwords corpus is downloaded here if it is
+        not installed yet, so importing the module (e.g. in the spell_check worker processes) does not touch the
+        network or the disk.
+    """
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        if not nltk.download('stopwords'):
+            raise LookupError("Could not download the NLTK stopwords corpus")
+    return frozenset(stopwords.words('english'))
+
 
 def normalize_text(text):
     """Returns a normalized version of the specified string.
       You can add default parameters as you like (they should have default values!)
       You should explain your decisions in the header of the function.
+      The text is lowercased, every non-alphabetic character is replaced by a space and stop words are removed.
+      The words are split on whitespace rather than with word_tokenize, so contractions such as "cannot",
+      "gonna" and "wanna" stay single words where word_tokenize would split them.
 
       Args:
         text (str): the text to normalize
@@ -491,17 +834,14 @@ def normalize_text(text):
       Returns:
         string. the normalized text.
     """
-    # Convert to lowercase
-    text = text.lower()
-
-    # Remove non-alphabetic characters
-    text = re.sub('[^A-Za-z]', ' ', text)
+    # Convert to lowercase and replace non-alphabetic characters with spaces
+    text = _NON_ALPHABETIC.sub(' ', text.lower())
 
-    # Tokenize text into individual words
-    words = word_tokenize(text)
+    # Only letters and spaces are left, so splitting on whitespace tokenizes the text
+    words = text.split()
 
     # Remove stop words
-    stop_words = set(stopwords.words('english'))
+    stop_words = _stop_words()
     words = [word for word in words if word not in stop_words]
 
     # Rejoin words into a normalized string
@@ -1,5 +1,6 @@
 import unittest
 from language_model import *
+import language_model
 
 
 class MyTestCase(unittest.TestCase):
@@ -37,6 +38,31 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(self.lm.get_total_token_count(), expected_total_token_count)
         self.assertEqual(self.lm.get_token_frequency(), expected_token_frequency)
 
+    def test_model_dictionary_view(self):
+        self.lm.build_model("hello world")
+        model_dict = self.lm.get_model_dictionary()
+
+        # Unseen ngrams count 0, as in a defaultdict(int)
+        self.assertEqual(model_dict[('world', 'hello', '</s>')], 0)
+        self.assertNotIn(('world', 'hello', '</s>'), model_dict)
+
+        # Writes go to the model
+        model_dict[('<s>', 'hello', 'world')] += 1
+        self.assertEqual(self.lm.get_model_dictionary()[('<s>', 'hello', 'world')], 2)
+        self.assertAlmostEqual(self.lm.evaluate_text("hello world"), math.log(1 / 2) * 2 + math.log(2 / 2))
+
+        # pop, setdefault and del behave as with a dict
+        unseen = ('world', 'hello', '</s>')
+        self.assertEqual(model_dict.pop(unseen, 'default'), 'default')
+        with self.assertRaises(KeyError):
+            model_dict.pop(unseen)
+        with self.assertRaises(KeyError):
+            del model_dict[unseen]
+        self.assertEqual(model_dict.setdefault(unseen, 5), 5)
+        self.assertEqual(model_dict.setdefault(unseen, 7), 5)
+        self.assertEqual(model_dict.pop(unseen), 5)
+        self.assertNotIn(unseen, model_dict)
+
     def test_check_for_oov(self):
         text = "the cat sat on the mat"
         self.lm.build_model(text)
@@ -126,6 +152,21 @@ class MyTestCase(unittest.TestCase):
 
         self.assertAlmostEqual(expected_log_prob, actual_log_prob)
 
+    @unittest.skipIf(njit is None, "numba is not installed")
+    def test_evaluate_text_compiled(self):
+        self.lm.build_model(self.the_raven)
+        texts = ["Once upon a midnight dreary, while I pondered, weak and weary,",  # no unknown words
+                 "Once upon a midnight dreary, while I pondered, weak and sleepy,"]  # 'sleepy' is unknown
+        for text in texts:
+            compiled_log_prob = self.lm.evaluate_text(text)
+
+            # Without the hash table evaluate_text runs the Python loop
+            hash_keys, self.lm._ngram_hash_keys = self.lm._ngram_hash_keys, None
+            python_log_prob = self.lm.evaluate_text(text)
+            self.lm._ngram_hash_keys = hash_keys
+
+            self.assertAlmostEqual(compiled_log_prob, python_log_prob)
+
     def test_smooth(self):
         expected_dict = {
             ('the', 'quick', 'brown'): 1,
@@ -158,26 +199,26 @@ class MyTestCase(unittest.TestCase):
     def test_insertion_chars(self):
         token = "worda"
         candidate = "word"
-        result = Spell_Checker._insertion_chars(token, candidate)
-        self.assertEqual(result, "da")
+        result = Spell_Checker._error_signature(token, candidate)
+        self.assertEqual(result, ("insertion", "da"))
 
     def test_deletion_chars(self):
         token = "acress"
         candidate = "actress"
-        result = Spell_Checker._deletion_chars(token, candidate)
-        self.assertEqual(result, "ct")
+        result = Spell_Checker._error_signature(token, candidate)
+        self.assertEqual(result, ("deletion", "ct"))
 
     def test_transposition_chars(self):
         token = "owrd"
         candidate = "word"
-        result = Spell_Checker._transposition_chars(token, candidate)
-        self.assertEqual(result, "wo")
+        result = Spell_Checker._error_signature(token, candidate)
+        self.assertEqual(result, ("transposition", "wo"))
 
     def test_substitution_chars(self):
         token = "aord"
         candidate = "word"
-        result = Spell_Checker._substitution_chars(token, candidate)
-        self.assertEqual(result, "aw")
+        result = Spell_Checker._error_signature(token, candidate)
+        self.assertEqual(result, ("substitution", "aw"))
 
     def test_check_characters_change(self):
         token = "worda"
@@ -211,6 +252,57 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(self.sc.count_chars_in_lm("xy"), 0)
         self.assertEqual(self.sc.count_chars_in_lm("he"), 2)
 
+    def test_edit_distance(self):
+        self.assertEqual(language_model._edit_distance("word", "word"), 0)
+        self.assertEqual(language_model._edit_distance("owrd", "word"), 1)
+        self.assertEqual(language_model._edit_distance("xword", "word"), 1)
+        self.assertEqual(language_model._edit_distance("wor", "word"), 1)
+        self.assertEqual(language_model._edit_distance("ca", "abc"), 3)
+
+    def test_candidates_by_distance(self):
+        self.lm.build_model("word sword world act actress")
+        self.sc.add_language_model(self.lm)
+
+        # Transposition
+        self.assertEqual(self.sc._candidates_by_distance("wrod", 1), {1: {'word'}})
+        # Insertion and deletion at the word edges
+        self.assertEqual(self.sc._candidates_by_distance("xword", 1), {1: {'word', 'sword'}})
+        self.assertEqual(self.sc._candidates_by_distance("wor", 2), {1: {'word'}, 2: {'sword', 'world'}})
+        self.assertEqual(self.sc._candidates_by_distance("ac", 1), {1: {'act'}})
+        # Words further than max_dist are pruned
+        self.assertEqual(self.sc._candidates_by_distance("wor", 1), {1: {'word'}})
+        self.assertEqual(self.sc._candidates_by_distance("wxyz", 2), {1: set(), 2: set()})
+
+    def test_count_change_in_lm_model_set_by_hand(self):
+        self.lm.model_dict = {('<s>', '<s>', 'hello'): 1, ('<s>', 'hello', 'world'): 1, ('hello', 'world', '</s>'): 1}
+        self.lm.total_token_count = 2
+        self.lm.token_frequency = {'hello': 1, 'world': 1}
+        self.sc.add_language_model(self.lm)
+
+        self.assertEqual(self.sc.count_chars_in_lm("he"), 1)
+        self.assertEqual(self.sc.count_chars_in_lm("lo"), 1)
+        self.assertEqual(self.sc.count_chars_in_lm("ld"), 1)
+        self.assertEqual(self.sc.count_chars_in_lm("xy"), 0)
+
+    def test_noisy_channel_after_rebuild(self):
+        error_tables = {'deletion': {}, 'insertion': {}, 'substitution': {'ae': 1}, 'transposition': {}}
+        self.lm.build_model("hello world")
+        self.sc.add_language_model(self.lm)
+        self.sc.add_error_tables(error_tables)
+        self.sc.calculate_log_noisy_channel("hello", "hallo")
+
+        # Rebuilding the model in place invalidates the cached log probabilities
+        self.lm.build_model("hello there hello")
+        fresh_sc = Spell_Checker(self.lm)
+        fresh_sc.add_error_tables(error_tables)
+        self.assertEqual(self.sc.calculate_log_noisy_channel("hello", "hallo"),
+                         fresh_sc.calculate_log_noisy_channel("hello", "hallo"))
+
+    def test_normalize_text(self):
+        text = "The cat cannot catch a MOUSE, and the dog is gonna bark... wanna bet?"
+        # Lowercased, non-alphabetic characters and stop words removed, contractions kept whole
+        self.assertEqual(normalize_text(text), "cat cannot catch mouse dog gonna bark wanna bet")
+
     def test_spell_check(self):
         # Test case 1: No errors in the input text
         self.lm.build_model(self.big)
@@ -226,6 +318,37 @@ class MyTestCase(unittest.TestCase):
         actual_output = self.sc.spell_check(text, alpha)
         print(actual_output)
 
+    def test_spell_check_workers(self):
+        self.lm.build_model(self.the_raven)
+        self.sc.add_language_model(self.lm)
+        self.sc.add_error_tables(error_tables)
+        words = self.the_raven.split()[:2 * SPELL_CHECK_CHUNK_SIZE]
+        words[10] = words[10] + 'x'
+        words[-10] = words[-10][1:]
+        text = " ".join(words)
+        alpha = 0.95
+
+        self.assertEqual(self.sc.spell_check(text, alpha, workers=2), self.sc.spell_check(text, alpha))
+
+    def test_spell_check_short_words(self):
+        self.lm.build_model("a a a i the cat")
+        self.sc.add_language_model(self.lm)
+
+        # One letter substitution
+        self.assertEqual(self.sc.spell_check("u", 0.95), "a")
+        # Two letter words that are two substitutions away
+        self.assertEqual(self.sc._candidates_by_distance("xy", 2), {1: set(), 2: {'a', 'i'}})
+
+    def test_spell_check_model_set_by_hand(self):
+        self.lm.model_dict = {('<s>', '<s>', 'hello'): 1, ('<s>', 'hello', 'world'): 1, ('hello', 'world', '</s>'): 1}
+        self.lm.total_token_count = 2
+        self.lm.token_frequency = {'hello': 1, 'world': 1}
+        self.sc.add_language_model(self.lm)
+
+        self.assertEqual(self.sc.spell_check("helo wrld", 0.95), "hello world")
+        self.sc.add_error_tables({'deletion': {}, 'insertion': {}, 'substitution': {}, 'transposition': {}})
+        self.assertEqual(self.sc.calculate_log_noisy_channel("unknown", "unknwn"), 2 * math.log(0.0001))
+
     def test_correct_spelling(self):
         test_cases = [
             ("beutiful", "beautiful"),